@@ -629,7 +629,7 @@ class ApiBackend:
             self.conversation_title = conversation.title
         return self._handle_response(success, conversation, user_message)
 
-    def get_history(self, limit=20, offset=0, user_id=None):
+    def get_history(self, limit=20, offset=0, user_id=None, before_id=None):
         """
         Get conversation history.
 
@@ -639,12 +639,14 @@ class ApiBackend:
         :type offset: int, optional
         :param user_id: User id, defaults to current
         :type user_id: int, optional
+        :param before_id: Only return conversations older than this id, ignores offset
+        :type before_id: int, optional
         :returns: success, history dict, message
         :rtype: tuple
         """
         user_id = user_id if user_id else self.current_user.id
         success, conversations, message = self.conversation.get_conversations(
-            user_id, limit=limit, offset=offset
+            user_id, limit=limit, offset=offset, before_id=before_id
         )
         if success:
             history = {m.id: self.orm.object_as_dict(m) for m in conversations}
@@ -679,7 +681,10 @@ class ApiBackend:
             return None
         if self.conversation_title:
             return self.conversation_title
-        success, conversation, message = self.conversation.get_conversation(self.conversation_id)
+        # The title is saved by the title generation thread, in another session.
+        success, conversation, message = self.conversation.get_conversation(
+            self.conversation_id, refresh=True
+        )
         return success and conversation.title or None
 
     def new_conversation(self):
@@ -4,10 +4,12 @@ from lwe.backends.api.orm import Manager
 
 
 class ConversationManager(Manager):
-    def get_conversations(self, user_id, limit=None, offset=None, order_desc=True):
+    def get_conversations(self, user_id, limit=None, offset=None, order_desc=True, before_id=None):
         try:
             user = self.orm_get_user(user_id)
-            conversations = self.orm_get_conversations(user, limit, offset, order_desc)
+            conversations = self.orm_get_conversations(
+                user, limit, offset, order_desc, before_id=before_id
+            )
             return True, conversations, "Conversations retrieved successfully."
         except SQLAlchemyError as e:
             return self._handle_error(f"Failed to retrieve conversations: {str(e)}")
@@ -20,9 +22,9 @@ class ConversationManager(Manager):
         except SQLAlchemyError as e:
             return self._handle_error(f"Failed to create conversation: {str(e)}")
 
-    def get_conversation(self, conversation_id):
+    def get_conversation(self, conversation_id, refresh=False):
         try:
-            conversation = self.orm_get_conversation(conversation_id)
+            conversation = self.orm_get_conversation(conversation_id, refresh)
             if conversation:
                 return True, conversation, "Conversation retrieved successfully."
             else:
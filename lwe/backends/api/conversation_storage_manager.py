@@ -113,13 +113,9 @@ class ConversationStorageManager:
         :rtype: tuple
         """
         conversation = self.create_new_conversation_if_needed(title)
-        last_message = None
-        for m in new_messages:
-            success, last_message, user_message = self.add_message(
-                m["role"], m["message"], m["message_type"], m["message_metadata"]
-            )
-            if not success:
-                raise Exception(user_message)
+        success, last_message, user_message = self.add_messages(new_messages)
+        if not success:
+            raise Exception(user_message)
         return (
             True,
             (conversation, last_message),
@@ -152,6 +148,23 @@ class ConversationStorageManager:
             self.preset_name,
         )
 
+    def add_messages(self, messages):
+        """
+        Add multiple new messages to a conversation in a single transaction.
+
+        :param messages: Messages, each with role, message, message_type and message_metadata
+        :type messages: list
+        :returns: success, last added message, user message
+        :rtype: tuple
+        """
+        return self.message.add_messages(
+            self.conversation_id,
+            messages,
+            self.provider.name,
+            self.model_name,
+            self.preset_name,
+        )
+
     def get_title_provider_llm(self):
         """
         Get the title provider and LLM.
@@ -186,6 +199,21 @@ class ConversationStorageManager:
         """
         Generate the title for a conversation in a separate thread.
 
+        :param conversation_id: Conversation ID
+        :type conversation_id: int
+        """
+        try:
+            self.generate_title(conversation_id)
+        finally:
+            # The thread's sessions are not used again, release their
+            # connections back to the pool even if generation failed.
+            self.orm.session.remove()
+            self.orm.read_session.remove()
+
+    def generate_title(self, conversation_id):
+        """
+        Generate and save the title for a conversation.
+
         :param conversation_id: Conversation ID
         :type conversation_id: int
         """
@@ -239,7 +267,7 @@ class ConversationStorageManager:
         if database.startswith("sqlite") and ":memory:" in database:
             # Special case for in memory SQLite, as it cannot access the
             # in memory database from another thread.
-            self.gen_title_thread(conversation_id)
+            self.generate_title(conversation_id)
         else:
             thread = threading.Thread(target=self.gen_title_thread, args=(conversation_id,))
             thread.start()
@@ -3,6 +3,7 @@
 import names
 import argparse
 
+from sqlalchemy import inspect
 from sqlalchemy.exc import OperationalError
 
 from lwe.core import constants
@@ -30,11 +31,10 @@ class Database:
         self.message = MessageManager(self.config, self.orm)
 
     def schema_exists(self):
-        # Necessary to create a new engine/metadata here, as the tables are cached,
-        # and we need to know the current state.
-        _, metadata = self.orm.create_engine_and_metadata()
+        # Inspect the database directly, as the declared metadata always
+        # contains the tables, and we need to know the current state.
         try:
-            if len(metadata.tables.keys()) > 0:
+            if len(inspect(self.orm.engine).get_table_names()) > 0:
                 self.log.debug("The database schema exists.")
                 return True
         except OperationalError:
@@ -70,6 +70,7 @@ class DatabaseDevel(Database):
         self.force = args.force
         self.test_data = args.test_data
         self.print = args.print
+        self.maintenance = args.maintenance
 
     def create_test_data(self):
         util.print_status_message(True, "Creating users...")
@@ -138,6 +139,15 @@ class DatabaseDevel(Database):
                 )
         if self.print:
             self.print_data()
+        if self.maintenance:
+            if self.schema_exists():
+                self.orm.maintenance()
+                util.print_status_message(True, "Database maintenance complete")
+            else:
+                util.print_status_message(
+                    False,
+                    "Cannot run maintenance, database not created, use --create to create it",
+                )
 
 
 def main():
@@ -160,6 +170,12 @@ def main():
         action="store_true",
         help="print out the created data",
     )
+    parser.add_argument(
+        "-M",
+        "--maintenance",
+        action="store_true",
+        help="refresh query planner statistics and compact the database",
+    )
     parser.add_argument(
         "-f",
         "--force",
@@ -192,8 +208,8 @@ def main():
     )
     args = parser.parse_args()
 
-    if not (args.create or args.test_data or args.print):
-        parser.error("At least one of --create, --test-data, --print must be set")
+    if not (args.create or args.test_data or args.print or args.maintenance):
+        parser.error("At least one of --create, --test-data, --print, --maintenance must be set")
 
     config = Config()
     config.load_from_file()
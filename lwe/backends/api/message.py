@@ -1,7 +1,6 @@
 import json
 
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import object_mapper
 
 from lwe.backends.api.orm import Manager, Message
 from lwe.backends.api.conversation import ConversationManager
@@ -26,17 +25,13 @@ class MessageManager(Manager):
     def message_to_storage(self, message, message_type, message_metadata):
         if message_type in JSON_MESSAGE_TYPES:
             message = json.dumps(message)
-        message_metadata = json.dumps(message_metadata) if message_metadata else None
-        return message, message_metadata
+        return message, message_metadata or None
 
     def message_from_storage(self, message):
         if isinstance(message, Message):
-            message = {c.key: getattr(message, c.key) for c in object_mapper(message).columns}
+            message = self.orm.object_as_dict(message)
         if message["message_type"] in JSON_MESSAGE_TYPES:
             message["message"] = json.loads(message["message"], strict=False)
-        message["message_metadata"] = (
-            json.loads(message["message_metadata"]) if message["message_metadata"] else None
-        )
         return message
 
     def get_message(self, message_id):
@@ -49,16 +44,19 @@ class MessageManager(Manager):
             return False, None, "Message not found"
         return True, message, "Message retrieved successfully"
 
-    def get_messages(self, conversation_id, limit=None, offset=None, target_id=None):
+    def get_messages(self, conversation_id, limit=None, offset=None, target_id=None, after_id=None):
         success, conversation, message = self.conversation_manager.get_conversation(conversation_id)
         if not success:
             return success, conversation, message
         if not conversation:
             return False, None, "Conversation not found"
         try:
-            messages = self.orm_get_messages(
-                conversation, limit=limit, offset=offset, target_id=None
-            )
+            if limit is None and offset is None:
+                messages = self.orm_iter_messages(conversation, target_id=None, after_id=after_id)
+            else:
+                messages = self.orm_get_messages(
+                    conversation, limit=limit, offset=offset, target_id=None, after_id=after_id
+                )
             messages = [self.message_from_storage(message) for message in messages]
         except SQLAlchemyError as e:
             return self._handle_error(f"Failed to retrieve messages: {str(e)}")
@@ -106,6 +104,36 @@ class MessageManager(Manager):
             return self._handle_error(f"Failed to add message: {str(e)}")
         return True, message, "Message added successfully"
 
+    def add_messages(self, conversation_id, messages, provider=None, model=None, preset=None):
+        success, conversation, user_message = self.conversation_manager.get_conversation(
+            conversation_id
+        )
+        if not success:
+            return success, conversation, user_message
+        if not conversation:
+            return False, None, "Conversation not found"
+        try:
+            rows = []
+            for m in messages:
+                message, message_metadata = self.message_to_storage(
+                    m["message"], m["message_type"], m["message_metadata"]
+                )
+                rows.append(
+                    {
+                        "role": m["role"],
+                        "message": message,
+                        "message_type": m["message_type"],
+                        "message_metadata": message_metadata,
+                        "provider": provider,
+                        "model": model,
+                        "preset": preset,
+                    }
+                )
+            last_message = self.orm_add_messages(conversation, rows)
+        except SQLAlchemyError as e:
+            return self._handle_error(f"Failed to add messages: {str(e)}")
+        return True, last_message, "Messages added successfully"
+
     # TODO: Currently unused, but would need to account for self.message_to_storage() if used.
     # def edit_message(self, message_id, **kwargs):
     #     success, message, user_message = self.get_message(message_id)
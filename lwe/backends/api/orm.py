@@ -1,15 +1,19 @@
-import datetime
+import orjson
 
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
-from sqlite3 import Connection as SQLite3Connection
-from sqlalchemy import MetaData, ForeignKey, Index, Column, Integer, String, DateTime, JSON, Boolean
-from sqlalchemy import desc
+from sqlite3 import Connection as SQLite3Connection, Error as SQLite3Error
+from sqlalchemy import ForeignKey, Index, Column, Integer, String, DateTime, JSON, Boolean
+from sqlalchemy import bindparam, desc, select, insert, update, delete
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import Pool, QueuePool, StaticPool
 from sqlalchemy import inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 
 from lwe.core.config import Config
 from lwe.core.logger import Logger
@@ -17,17 +21,75 @@ import lwe.core.constants as constants
 
 Base = declarative_base()
 
+# Column attribute keys per mapped class, used by Orm.object_as_dict().
+_COLUMN_KEYS_CACHE = {}
+
 
 def _set_sqlite_pragma(conn, _record):
     if isinstance(conn, SQLite3Connection):
         cursor = conn.cursor()
         cursor.execute("PRAGMA foreign_keys=ON;")
+        # WAL lets readers proceed while a write is in progress, and with
+        # synchronous=NORMAL a commit is a single append to the WAL file
+        # rather than an fsync of a rollback journal. This also makes the
+        # check_same_thread=False usage for title generation safer.
+        cursor.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;
+            PRAGMA mmap_size=268435456;
+            PRAGMA busy_timeout=5000;
+            """
+        )
         cursor.close()
 
 
 event.listen(Engine, "connect", _set_sqlite_pragma)
 
 
+def _optimize_sqlite(conn, _record):
+    # Lets SQLite refresh planner statistics for tables whose usage suggests
+    # they are stale, which is cheap enough to do whenever a connection closes.
+    # Pooled connections stay open for the life of the engine, so apart from
+    # overflow connections this runs when the engine is disposed, see
+    # Orm.close().
+    if isinstance(conn, SQLite3Connection):
+        try:
+            conn.execute("PRAGMA optimize;")
+        except SQLite3Error:
+            pass
+
+
+event.listen(Pool, "close", _optimize_sqlite)
+
+
+def _json_serializer(value):
+    # orjson returns bytes, the database driver expects text. Non-str dict
+    # keys are converted to strings, as the standard json module does.
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+class local_now(FunctionElement):
+    """Current local time, evaluated by the database."""
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(local_now)
+def _compile_local_now(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(local_now, "sqlite")
+def _compile_local_now_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP is UTC on SQLite, existing rows store local time.
+    # Formatted like the DateTime type stores values, with microseconds.
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now', 'localtime')"
+
+
 class User(Base):
     __tablename__ = "user"
 
@@ -36,37 +98,35 @@ class User(Base):
     password = Column(String, nullable=True)
     email = Column(String, unique=True, nullable=True)
     default_preset = Column(String, nullable=False)
-    created_time = Column(DateTime, nullable=False)
+    created_time = Column(DateTime, nullable=False, default=local_now())
     last_login_time = Column(DateTime, nullable=True)
     preferences = Column(JSON, nullable=False)
 
     conversations = relationship("Conversation", back_populates="user", passive_deletes=True)
 
 
-Index("user_username_idx", User.username)
-Index("user_email_idx", User.email)
-Index("user_created_time_idx", User.created_time)
-Index("user_last_login_time", User.last_login_time)
-
-
 class Conversation(Base):
     __tablename__ = "conversation"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
     title = Column(String, nullable=True)
-    created_time = Column(DateTime, nullable=False)
-    updated_time = Column(DateTime, nullable=False)
+    created_time = Column(DateTime, nullable=False, default=local_now())
+    # Bumped explicitly when messages are added, not on every edit.
+    updated_time = Column(DateTime, nullable=False, default=local_now())
     hidden = Column(Boolean, nullable=False)
 
     user = relationship("User", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation", passive_deletes=True)
 
 
-Index("conversation_user_id_idx", Conversation.user_id)
-Index("conversation_created_time_idx", Conversation.created_time)
-Index("conversation_updated_time_idx", Conversation.updated_time)
-Index("conversation_hidden_idx", Conversation.hidden)
+Index("conversation_user_id_id_idx", Conversation.user_id, Conversation.id.desc())
+Index(
+    "conversation_visible_idx",
+    Conversation.user_id,
+    Conversation.id.desc(),
+    sqlite_where=Conversation.hidden.is_(False),
+)
 
 
 class Message(Base):
@@ -79,17 +139,18 @@ class Message(Base):
     role = Column(String, nullable=False)
     message = Column(String, nullable=False)
     message_type = Column(String, nullable=False)
-    message_metadata = Column(String)
+    message_metadata = Column(JSON(none_as_null=True))
     model = Column(String, nullable=False)
     provider = Column(String, nullable=False)
     preset = Column(String, nullable=False)
-    created_time = Column(DateTime, nullable=False)
+    created_time = Column(DateTime, nullable=False, default=local_now())
 
     conversation = relationship("Conversation", back_populates="messages")
 
 
+# Message.id is the table's rowid, which SQLite already appends to every index
+# entry, so this index also serves ORDER BY id without storing id twice.
 Index("message_conversation_id_idx", Message.conversation_id)
-Index("message_created_time_idx", Message.created_time)
 
 
 class Orm:
@@ -99,99 +160,241 @@ class Orm:
         self.database = self.config.get("database")
         self.engine, self.metadata = self.create_engine_and_metadata()
         self.session = scoped_session(sessionmaker(bind=self.engine))
+        if isinstance(self.engine.pool, StaticPool):
+            # Every session shares the one connection, so ending a read
+            # session would roll back the main session's pending work. Reads
+            # run in the main session instead.
+            self.read_session = self.session
+            self.stream_session = self.session
+        else:
+            # Listing queries don't modify anything, so they run in a separate
+            # session that skips autoflush and never expires what it loaded.
+            read_sessionmaker = sessionmaker(
+                bind=self.engine, autoflush=False, expire_on_commit=False
+            )
+            self.read_session = scoped_session(read_sessionmaker)
+            # Streaming reads outlive the call that started them, so each one
+            # gets a session of its own rather than the thread's read session,
+            # which any other read on the same thread closes.
+            self.stream_session = read_sessionmaker
 
     def create_engine_and_metadata(self):
-        args = ""
-        # TODO: check_same_thread is currently needed for SQLite so the
-        # separate thread that generates titles can run without error.
-        # It would probably be better to work this out with locking or
-        # a separate database connection or other fix.
-        if self.database.startswith("sqlite"):
-            args = "?check_same_thread=False"
-        engine = create_engine(f"{self.database}{args}")
-        metadata = MetaData()
-        metadata.reflect(bind=engine)
-        return engine, metadata
+        kwargs = {}
+        url = make_url(self.database)
+        if url.get_backend_name() == "sqlite":
+            # check_same_thread is needed so the separate thread that
+            # generates titles can use pooled connections.
+            kwargs["connect_args"] = {"check_same_thread": False}
+            if url.database in (None, "", ":memory:") or url.query.get("mode") == "memory":
+                # Every connection to an in-memory database is a new database,
+                # so all sessions must share the one connection.
+                kwargs["poolclass"] = StaticPool
+            else:
+                # Persistent connections keep SQLite's page cache warm and
+                # avoid re-running the connect PRAGMAs, while still giving
+                # each session its own connection and transaction.
+                kwargs["poolclass"] = QueuePool
+        # Sized to hold the compiled forms of all the Manager queries across
+        # their limit/offset variants.
+        engine = create_engine(
+            self.database,
+            future=True,
+            query_cache_size=1200,
+            json_serializer=_json_serializer,
+            json_deserializer=orjson.loads,
+            **kwargs,
+        )
+        # All tables are declared on Base, so there is no need to reflect
+        # them from the database.
+        return engine, Base.metadata
+
+    def analyze(self):
+        if self.engine.dialect.name != "sqlite":
+            return
+        self.log.debug("Analyzing database to refresh query planner statistics")
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql("ANALYZE")
+            conn.commit()
+
+    def maintenance(self):
+        if self.engine.dialect.name != "sqlite":
+            return
+        self.log.info("Running database maintenance: ANALYZE, VACUUM")
+        # VACUUM cannot run inside a transaction.
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("ANALYZE")
+            conn.exec_driver_sql("VACUUM")
+
+    def close(self):
+        self.session.remove()
+        self.read_session.remove()
+        # Closes the pooled connections, which runs PRAGMA optimize on each.
+        self.engine.dispose()
 
     def object_as_dict(self, obj):
-        return {c.key: getattr(obj, c.key) for c in inspect(obj).mapper.column_attrs}
+        cls = type(obj)
+        keys = _COLUMN_KEYS_CACHE.get(cls)
+        if keys is None:
+            keys = _COLUMN_KEYS_CACHE[cls] = tuple(c.key for c in inspect(cls).column_attrs)
+        return {key: getattr(obj, key) for key in keys}
 
 
 class Manager:
+    # Primary key lookups, built once and reused for every call.
+    _get_by_id_stmts = {
+        model: select(model).where(model.id == bindparam("pk"))
+        for model in (User, Conversation, Message)
+    }
+
     def __init__(self, config=None, orm=None):
         self.config = config or Config()
         self.log = Logger(self.__class__.__name__, self.config)
         self.orm = orm or Orm(self.config)
-        self.session = self.orm.session()
+
+    @property
+    def session(self):
+        # Resolved on every access, so each thread gets its own session from
+        # the scoped_session registry, even when sharing a Manager.
+        return self.orm.session()
 
     def _handle_error(self, message):
         self.log.error(message)
         return False, None, message
 
-    def _apply_limit_offset(self, query, limit, offset):
+    def _close_read_session(self, session):
+        # End the read transaction, so the next read sees a fresh snapshot
+        # instead of objects left over in the identity map. Skipped when
+        # reads share the main session, see Orm.__init__().
+        if self.orm.read_session is not self.orm.session:
+            session.close()
+
+    def _get_by_id(self, model, pk, refresh=False):
+        # Same semantics as session.get(): an object already loaded in the
+        # session is returned without a query, otherwise the row is loaded
+        # with the prebuilt statement.
+        session = self.session
+        if not refresh:
+            obj = session.identity_map.get(Session.identity_key(model, pk))
+            if obj is not None and not inspect(obj).expired_attributes:
+                return obj
+        return session.execute(
+            self._get_by_id_stmts[model],
+            {"pk": pk},
+            execution_options={"populate_existing": refresh},
+        ).scalar_one_or_none()
+
+    def _read_scalars(self, stmt):
+        session = self.orm.read_session()
+        try:
+            return session.scalars(stmt).all()
+        finally:
+            self._close_read_session(session)
+
+    def _read_rows(self, stmt):
+        session = self.orm.read_session()
+        try:
+            return session.execute(stmt).all()
+        finally:
+            self._close_read_session(session)
+
+    def _stream_scalars(self, stmt, size):
+        session = self.orm.stream_session()
+        try:
+            yield from session.scalars(stmt.execution_options(yield_per=size))
+        finally:
+            self._close_read_session(session)
+
+    def _apply_limit_offset(self, stmt, limit, offset):
         if limit is not None:
-            query = query.limit(limit)
+            stmt = stmt.limit(limit)
         if offset is not None:
-            query = query.offset(offset)
-        return query
+            stmt = stmt.offset(offset)
+        return stmt
 
     def orm_get_users(self, limit=None, offset=None):
         self.log.debug("Retrieving all Users")
-        query = self.session.query(User).order_by(User.username)
-        query = self._apply_limit_offset(query, limit, offset)
-        users = query.all()
+        stmt = select(User).order_by(User.username)
+        stmt = self._apply_limit_offset(stmt, limit, offset)
+        users = self._read_scalars(stmt)
         return users
 
     def orm_get_conversations(
-        self, user, limit=constants.DEFAULT_HISTORY_LIMIT, offset=None, order_desc=True
+        self,
+        user,
+        limit=constants.DEFAULT_HISTORY_LIMIT,
+        offset=None,
+        order_desc=True,
+        before_id=None,
     ):
         self.log.debug(f"Retrieving Conversations for User with id {user.id}")
         if order_desc:
-            query = (
-                self.session.query(Conversation)
-                .filter(Conversation.user_id == user.id)
+            stmt = (
+                select(Conversation)
+                .where(Conversation.user_id == user.id)
                 .order_by(desc(Conversation.id))
             )
         else:
-            query = self.session.query(Conversation).order_by(Conversation.id)
-        query = self._apply_limit_offset(query, limit, offset)
-        conversations = query.all()
+            stmt = select(Conversation).order_by(Conversation.id)
+        stmt = stmt.where(Conversation.hidden.is_(False))
+        # Keyset pagination: seek past the last seen id instead of scanning
+        # and discarding offset rows.
+        if before_id is not None:
+            stmt = stmt.where(Conversation.id < before_id)
+            offset = None
+        stmt = self._apply_limit_offset(stmt, limit, offset)
+        conversations = self._read_scalars(stmt)
         return conversations
 
-    def orm_get_messages(self, conversation, limit=None, offset=None, target_id=None):
+    def orm_get_messages(
+        self, conversation, limit=None, offset=None, target_id=None, after_id=None
+    ):
         self.log.debug(f"Retrieving Messages for Conversation with id {conversation.id}")
-        query = (
-            self.session.query(Message)
-            .filter(Message.conversation_id == conversation.id)
-            .order_by(Message.id)
+        stmt = (
+            select(Message).where(Message.conversation_id == conversation.id).order_by(Message.id)
         )
-        query = self._apply_limit_offset(query, limit, offset)
         if target_id:
-            query = query.filter(Message.id <= target_id)
-        messages = query.all()
+            stmt = stmt.where(Message.id <= target_id)
+        if after_id is not None:
+            stmt = stmt.where(Message.id > after_id)
+            offset = None
+        stmt = self._apply_limit_offset(stmt, limit, offset)
+        messages = self._read_scalars(stmt)
         return messages
 
+    def orm_iter_messages(self, conversation, target_id=None, after_id=None):
+        # Streams the rows rather than loading the whole conversation before
+        # the caller sees the first message. Nothing is queried until the
+        # first iteration, so database errors are raised from the loop.
+        self.log.debug(f"Streaming Messages for Conversation with id {conversation.id}")
+        stmt = (
+            select(Message).where(Message.conversation_id == conversation.id).order_by(Message.id)
+        )
+        if target_id:
+            stmt = stmt.where(Message.id <= target_id)
+        if after_id is not None:
+            stmt = stmt.where(Message.id > after_id)
+        return self._stream_scalars(stmt, constants.ORM_YIELD_PER)
+
     def orm_get_last_message(self, conversation):
         self.log.debug(f"Retrieving last Message for Conversation with id {conversation.id}")
-        query = (
-            self.session.query(Message)
-            .filter(Message.conversation_id == conversation.id)
+        stmt = (
+            select(Message)
+            .where(Message.conversation_id == conversation.id)
             .order_by(Message.id.desc())
             .limit(1)
         )
-        last_message = query.first()
+        messages = self._read_scalars(stmt)
+        last_message = messages[0] if messages else None
         return last_message
 
     def orm_add_user(self, username, password, email, default_preset="", preferences=None):
         preferences = preferences or {}
-        now = datetime.datetime.now()
         user = User(
             username=username,
             password=password,
             email=email,
             default_preset=default_preset,
-            created_time=now,
-            last_login_time=now,
+            last_login_time=local_now(),
             preferences=preferences,
         )
         self.session.add(user)
@@ -200,10 +403,7 @@ class Manager:
         return user
 
     def orm_add_conversation(self, user, title, hidden=False):
-        now = datetime.datetime.now()
-        conversation = Conversation(
-            user_id=user.id, title=title, created_time=now, updated_time=now, hidden=False
-        )
+        conversation = Conversation(user_id=user.id, title=title, hidden=False)
         self.session.add(conversation)
         self.session.commit()
         self.log.info(f"Added Conversation with title: {title} for User {user.username}")
@@ -212,7 +412,6 @@ class Manager:
     def orm_add_message(
         self, conversation, role, message, message_type, message_metadata, provider, model, preset
     ):
-        now = datetime.datetime.now()
         message = Message(
             conversation_id=conversation.id,
             role=role,
@@ -222,31 +421,66 @@ class Manager:
             provider=provider,
             model=model,
             preset=preset,
-            created_time=now,
         )
         self.session.add(message)
-        # Original conversation was created in another session, so load one fresh.
-        conversation_update = self.orm_get_conversation(conversation.id)
-        conversation_update.updated_time = now
+        # Original conversation may have been loaded in another session, so
+        # bump its updated time directly, in the same transaction as the insert.
+        self.session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation.id)
+            .values(updated_time=local_now())
+        )
         self.session.commit()
         self.log.info(
             f"Added Message with role: {role}, message_type: {message_type}, message_metadata: {message_metadata}, provider: {provider}, model: {model}, preset: {preset} for Conversation with id {conversation.id}"
         )
         return message
 
+    def orm_add_messages(self, conversation, messages):
+        if not messages:
+            return None
+        rows = [
+            {
+                "conversation_id": conversation.id,
+                "role": m["role"],
+                "message": m["message"],
+                "message_type": m["message_type"],
+                "message_metadata": m["message_metadata"],
+                "provider": m["provider"],
+                "model": m["model"],
+                "preset": m["preset"],
+            }
+            for m in messages
+        ]
+        # Bulk insert all but the last row, which is added as an object so it
+        # can be returned without reading it back, as orm_add_message() does.
+        *bulk_rows, last_row = rows
+        if bulk_rows:
+            self.session.execute(insert(Message), bulk_rows)
+        last_message = Message(**last_row)
+        self.session.add(last_message)
+        self.session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation.id)
+            .values(updated_time=local_now())
+        )
+        self.session.commit()
+        self.log.info(f"Added {len(rows)} Messages for Conversation with id {conversation.id}")
+        return last_message
+
     def orm_get_user(self, user_id):
         self.log.debug(f"Retrieving User with id {user_id}")
-        user = self.session.get(User, user_id)
+        user = self._get_by_id(User, user_id)
         return user
 
-    def orm_get_conversation(self, conversation_id):
+    def orm_get_conversation(self, conversation_id, refresh=False):
         self.log.debug(f"Retrieving Conversation with id {conversation_id}")
-        conversation = self.session.get(Conversation, conversation_id)
+        conversation = self._get_by_id(Conversation, conversation_id, refresh)
         return conversation
 
     def orm_get_message(self, message_id):
         self.log.debug(f"Retrieving Message with id {message_id}")
-        message = self.session.get(Message, message_id)
+        message = self._get_by_id(Message, message_id)
         return message
 
     def orm_edit_user(self, user, **kwargs):
@@ -271,13 +505,20 @@ class Manager:
         return message
 
     def orm_delete_user(self, user):
-        self.session.delete(user)
+        # A single DELETE, the database removes the user's conversations and
+        # messages via ON DELETE CASCADE.
+        self.session.execute(delete(User).where(User.id == user.id))
+        # The cascaded rows may still be in the identity map, expire them so
+        # the next lookup goes to the database and finds them gone.
+        self.session.expire_all()
         self.session.commit()
         self.log.info(f"Deleted User with id {user.id}")
         return user
 
     def orm_delete_conversation(self, conversation):
-        self.session.delete(conversation)
+        self.session.execute(delete(Conversation).where(Conversation.id == conversation.id))
+        # Messages are removed by cascade, expire any still in the identity map.
+        self.session.expire_all()
         self.session.commit()
         self.log.info(f"Deleted Conversation with id {conversation.id}")
 
@@ -95,6 +95,9 @@ class ApiRepl(Repl):
             self.backend = ApiBackend(self.config)
         self.user_management = UserManager(self.config, self.backend.orm)
 
+    def cleanup(self):
+        self.backend.orm.close()
+
     def launch_backend(self, interactive=True):
         if interactive:
             self.check_login()
@@ -0,0 +1,26 @@
+"""Composite conversation index
+
+Revision ID: 5b1f0c9d2e47
+Revises: 4e642f725923
+Create Date: 2026-10-14 09:12:31.574210
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b1f0c9d2e47"
+down_revision = "4e642f725923"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_index("conversation_user_id_idx", table_name="conversation")
+    op.create_index(
+        "conversation_user_id_id_idx",
+        "conversation",
+        ["user_id", sa.text("id DESC")],
+    )
@@ -0,0 +1,26 @@
+"""Drop unused indexes
+
+Revision ID: a9c27e5b8d13
+Revises: e3a8d41c6f05
+Create Date: 2026-10-14 10:21:47.902615
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "a9c27e5b8d13"
+down_revision = "e3a8d41c6f05"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_index("user_username_idx", table_name="user")
+    op.drop_index("user_email_idx", table_name="user")
+    op.drop_index("user_created_time_idx", table_name="user")
+    op.drop_index("user_last_login_time", table_name="user")
+    op.drop_index("conversation_created_time_idx", table_name="conversation")
+    op.drop_index("conversation_updated_time_idx", table_name="conversation")
+    op.drop_index("message_created_time_idx", table_name="message")
@@ -0,0 +1,27 @@
+"""Partial index for visible conversations
+
+Revision ID: e3a8d41c6f05
+Revises: 5b1f0c9d2e47
+Create Date: 2026-10-14 09:48:05.118342
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e3a8d41c6f05"
+down_revision = "5b1f0c9d2e47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_index("conversation_hidden_idx", table_name="conversation")
+    op.create_index(
+        "conversation_visible_idx",
+        "conversation",
+        ["user_id", sa.text("id DESC")],
+        sqlite_where=sa.text("hidden IS 0"),
+    )
@@ -67,6 +67,8 @@ class SchemaUpdater:
             self.log.info("Initializing alembic versioning")
             self.stamp_database(None)
         command.upgrade(self.alembic_cfg, "head")
+        # Migrations may add or drop indexes, refresh the planner statistics.
+        self.orm.analyze()
 
     def stamp_database(self, revision="head"):
         self.log.debug("Stamping database with version: %s", revision)
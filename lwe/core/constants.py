@@ -11,6 +11,8 @@ PROVIDER_PRIVATE_CUSTOMIZATION_KEYS = [
 
 # Backend speciifc constants
 API_BACKEND_DEFAULT_MODEL = "gpt-3.5-turbo"
+# Number of rows fetched per batch when streaming unbounded ORM queries.
+ORM_YIELD_PER = 200
 
 SYSTEM_MESSAGE_DEFAULT = "You are a helpful assistant."
 SYSTEM_MESSAGE_PROGRAMMER = (
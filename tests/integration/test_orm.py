@@ -0,0 +1,280 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from lwe.backends.api.database import Database
+from lwe.backends.api.message import MessageManager
+from lwe.backends.api.orm import Orm, Manager, Message
+import lwe.core.constants as constants
+
+
+def use_file_database(test_config, tmp_path):
+    # Unlike :memory:, every session gets its own connection and transaction.
+    test_config.set("database", f"sqlite:///{os.path.join(tmp_path, 'test.db')}")
+
+
+def make_manager(test_config):
+    orm = Orm(test_config)
+    database = Database(test_config, orm=orm)
+    database.create_schema()
+    return Manager(test_config, orm=orm)
+
+
+def add_conversations(manager, user, count):
+    return [manager.orm_add_conversation(user, f"Conversation {i}") for i in range(count)]
+
+
+def add_messages(manager, conversation, count):
+    for i in range(count):
+        manager.orm_add_message(
+            conversation, "user", f"Message {i}", "content", None, "provider", "model", ""
+        )
+
+
+def test_orm_get_conversations_before_id(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation_ids = [c.id for c in add_conversations(manager, user, 5)]
+    first_page = manager.orm_get_conversations(user, limit=2)
+    assert [c.id for c in first_page] == conversation_ids[::-1][:2]
+    second_page = manager.orm_get_conversations(user, limit=2, before_id=first_page[-1].id)
+    assert [c.id for c in second_page] == conversation_ids[::-1][2:4]
+
+
+def test_orm_get_conversations_before_id_ignores_offset(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation_ids = [c.id for c in add_conversations(manager, user, 5)]
+    page = manager.orm_get_conversations(user, limit=2, offset=3, before_id=conversation_ids[-1])
+    assert [c.id for c in page] == conversation_ids[::-1][1:3]
+
+
+def test_orm_get_conversations_excludes_hidden(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversations = add_conversations(manager, user, 3)
+    manager.orm_edit_conversation(conversations[1], hidden=True)
+    listed = manager.orm_get_conversations(user)
+    assert [c.id for c in listed] == [conversations[2].id, conversations[0].id]
+    manager.orm_edit_conversation(conversations[1], hidden=False)
+    assert len(manager.orm_get_conversations(user)) == 3
+
+
+def test_orm_get_messages_after_id(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    add_messages(manager, conversation, 5)
+    first_page = manager.orm_get_messages(conversation, limit=2)
+    assert [m.message for m in first_page] == ["Message 0", "Message 1"]
+    second_page = manager.orm_get_messages(conversation, limit=2, after_id=first_page[-1].id)
+    assert [m.message for m in second_page] == ["Message 2", "Message 3"]
+
+
+def test_orm_iter_messages(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    add_messages(manager, conversation, 3)
+    messages = manager.orm_iter_messages(conversation)
+    assert not isinstance(messages, list)
+    assert [m.message for m in messages] == ["Message 0", "Message 1", "Message 2"]
+
+
+def test_orm_iter_messages_survives_reads_during_iteration(test_config, tmp_path, monkeypatch):
+    use_file_database(test_config, tmp_path)
+    monkeypatch.setattr(constants, "ORM_YIELD_PER", 2)
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    add_messages(manager, conversation, 5)
+    streamed = []
+    for message in manager.orm_iter_messages(conversation):
+        streamed.append(message.message)
+        assert manager.orm_get_last_message(conversation).message == "Message 4"
+    assert streamed == [f"Message {i}" for i in range(5)]
+
+
+def test_orm_get_conversation_sees_commit_from_other_thread(test_config, tmp_path):
+    use_file_database(test_config, tmp_path)
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, None)
+    conversation_id = conversation.id
+    assert manager.orm_get_conversation(conversation_id).title is None
+
+    def set_title():
+        try:
+            other = manager.orm_get_conversation(conversation_id)
+            manager.orm_edit_conversation(other, title="Generated")
+        finally:
+            manager.orm.session.remove()
+
+    thread = threading.Thread(target=set_title)
+    thread.start()
+    thread.join()
+    add_messages(manager, conversation, 1)
+    assert manager.orm_get_conversation(conversation_id).title == "Generated"
+
+
+def test_orm_delete_conversation_removes_cascaded_messages_from_session(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    message = manager.orm_add_message(
+        conversation, "user", "Message", "content", None, "provider", "model", ""
+    )
+    message_id = message.id
+    manager.orm_delete_conversation(conversation)
+    assert manager.orm_get_message(message_id) is None
+
+
+def test_orm_delete_user_removes_cascaded_rows_from_session(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    conversation_id = conversation.id
+    manager.orm_delete_user(user)
+    assert manager.orm_get_conversation(conversation_id) is None
+
+
+def test_add_messages(test_config):
+    manager = make_manager(test_config)
+    message_manager = MessageManager(test_config, orm=manager.orm)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    manager.orm_edit_conversation(conversation, updated_time=datetime(2000, 1, 1))
+    metadata = {"name": "test_tool", "id": "call_1"}
+    messages = [
+        message_manager.build_message("user", "Message 0"),
+        message_manager.build_message("assistant", {"args": {"n": 1}}, "tool_call", metadata),
+        message_manager.build_message("assistant", "Message 2"),
+    ]
+    success, last_message, user_message = message_manager.add_messages(
+        conversation.id, messages, "provider", "model", ""
+    )
+    assert success
+    assert last_message.message == "Message 2"
+    success, stored, user_message = message_manager.get_messages(conversation.id)
+    assert success
+    assert [m["id"] for m in stored] == sorted(m["id"] for m in stored)
+    assert stored[-1]["id"] == last_message.id
+    assert [m["role"] for m in stored] == ["user", "assistant", "assistant"]
+    assert stored[1]["message"] == {"args": {"n": 1}}
+    assert stored[1]["message_metadata"] == metadata
+    assert stored[0]["message_metadata"] is None
+    assert manager.orm_get_conversation(conversation.id).updated_time > datetime(2000, 1, 1)
+
+
+def get_sqlite_table_names(test_config):
+    path = test_config.get("database").removeprefix("sqlite:///")
+    with sqlite3.connect(path) as conn:
+        return [row[0] for row in conn.execute("SELECT name FROM sqlite_master")]
+
+
+def test_orm_analyze(test_config, tmp_path):
+    use_file_database(test_config, tmp_path)
+    manager = make_manager(test_config)
+    manager.orm.analyze()
+    assert "sqlite_stat1" in get_sqlite_table_names(test_config)
+
+
+def test_orm_maintenance(test_config, tmp_path):
+    use_file_database(test_config, tmp_path)
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    add_messages(manager, conversation, 3)
+    manager.orm.maintenance()
+    assert "sqlite_stat1" in get_sqlite_table_names(test_config)
+    assert len(manager.orm_get_messages(conversation)) == 3
+
+
+def test_orm_close_releases_connections(test_config, tmp_path):
+    use_file_database(test_config, tmp_path)
+    manager = make_manager(test_config)
+    manager.orm_add_user("test", None, None)
+    manager.orm.close()
+    assert manager.orm.engine.pool.checkedin() == 0
+    assert manager.orm.engine.pool.checkedout() == 0
+
+
+def test_orm_json_columns_accept_non_str_keys(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None, preferences={1: "a"})
+    conversation = manager.orm_add_conversation(user, "Test")
+    manager.orm_add_message(
+        conversation, "user", "Message", "content", {2: "b"}, "provider", "model", ""
+    )
+    assert manager.orm_get_users()[0].preferences == {"1": "a"}
+    assert manager.orm_get_messages(conversation)[0].message_metadata == {"2": "b"}
+
+
+def test_orm_reads_keep_pending_writes_on_shared_connection(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    message = Message(
+        conversation_id=conversation.id,
+        role="user",
+        message="Message",
+        message_type="content",
+        provider="provider",
+        model="model",
+        preset="",
+    )
+    manager.session.add(message)
+    manager.session.flush()
+    assert manager.orm_get_last_message(conversation).id == message.id
+    assert [m.message for m in manager.orm_iter_messages(conversation)] == ["Message"]
+    manager.session.commit()
+    assert [m.message for m in manager.orm_get_messages(conversation)] == ["Message"]
+
+
+def test_orm_timestamps_filled_in_local_time(test_config):
+    manager = make_manager(test_config)
+    before = datetime.now().replace(microsecond=0)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    message = manager.orm_add_message(
+        conversation, "user", "Message", "content", None, "provider", "model", ""
+    )
+    after = datetime.now() + timedelta(seconds=1)
+    for timestamp in (
+        user.created_time,
+        user.last_login_time,
+        conversation.created_time,
+        conversation.updated_time,
+        message.created_time,
+    ):
+        assert before <= timestamp <= after
+
+
+def test_orm_conversation_updated_time_bumped_only_by_messages(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation = manager.orm_add_conversation(user, "Test")
+    manager.orm_edit_conversation(conversation, updated_time=datetime(2000, 1, 1))
+    manager.orm_edit_conversation(conversation, title="New title", hidden=True)
+    assert conversation.updated_time == datetime(2000, 1, 1)
+    add_messages(manager, conversation, 1)
+    assert conversation.updated_time > datetime(2000, 1, 1)
+
+
+def test_orm_get_conversation_uses_identity_map(test_config):
+    manager = make_manager(test_config)
+    user = manager.orm_add_user("test", None, None)
+    conversation_id = manager.orm_add_conversation(user, "Test").id
+    conversation = manager.orm_get_conversation(conversation_id)
+    statements = []
+    event.listen(
+        manager.orm.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    assert manager.orm_get_conversation(conversation_id) is conversation
+    assert statements == []
+    assert manager.orm_get_conversation(conversation_id, refresh=True) is conversation
+    assert len(statements) == 1
+    assert manager.orm_get_conversation(conversation_id + 1) is None
@@ -1,3 +1,4 @@
+import pytest
 from unittest.mock import Mock
 
 from lwe.core import constants
@@ -114,7 +115,7 @@ def test_add_new_messages_to_conversation(test_config, tool_manager, provider_ma
     message_mock = Mock()
     conversation_mock = Mock()
     conversation_mock.id = 1
-    csm.message.add_message = Mock(return_value=(True, message_mock, "Success"))
+    csm.message.add_messages = Mock(return_value=(True, message_mock, "Success"))
     csm.conversation.add_conversation = Mock(return_value=(True, conversation_mock, "Success"))
     success, response, message = csm.add_new_messages_to_conversation(
         [{"role": "user", "message": "Hello", "message_type": "content", "message_metadata": None}],
@@ -124,7 +125,7 @@ def test_add_new_messages_to_conversation(test_config, tool_manager, provider_ma
     conversation, last_message = response
     assert conversation == conversation_mock
     assert last_message == message_mock
-    assert csm.message.add_message.call_count == 1
+    assert csm.message.add_messages.call_count == 1
     assert message.startswith("Added new messages to conversation")
 
 
@@ -149,6 +150,38 @@ def test_add_message(test_config, tool_manager, provider_manager):
     assert csm.message.add_message.call_args.args[7] == ""
 
 
+def test_add_messages(test_config, tool_manager, provider_manager):
+    csm = make_conversation_storage_manager(
+        test_config, tool_manager, provider_manager, current_user=Mock(), conversation_id=1
+    )
+    message_mock = Mock()
+    success_message = "Messages added successfully"
+    messages = [
+        {"role": "user", "message": "Hello", "message_type": "content", "message_metadata": None}
+    ]
+    csm.message.add_messages = Mock(return_value=(True, message_mock, success_message))
+    success, message, user_message = csm.add_messages(messages)
+    assert success
+    assert message == message_mock
+    assert user_message == success_message
+    assert csm.message.add_messages.call_args.args[0] == 1
+    assert csm.message.add_messages.call_args.args[1] == messages
+    assert csm.message.add_messages.call_args.args[2] == "provider_fake_llm"
+    assert csm.message.add_messages.call_args.args[3] == constants.API_BACKEND_DEFAULT_MODEL
+    assert csm.message.add_messages.call_args.args[4] == ""
+
+
+def test_gen_title_thread_removes_sessions_on_failure(
+    test_config, tool_manager, provider_manager
+):
+    csm = make_conversation_storage_manager(test_config, tool_manager, provider_manager)
+    csm.generate_title = Mock(side_effect=RuntimeError("LLM unavailable"))
+    with pytest.raises(RuntimeError):
+        csm.gen_title_thread(1)
+    csm.orm.session.remove.assert_called_once()
+    csm.orm.read_session.remove.assert_called_once()
+
+
 def test_get_conversation_token_count(test_config, tool_manager, provider_manager):
     csm = make_conversation_storage_manager(
         test_config, tool_manager, provider_manager, current_user=Mock(), conversation_id=1